@@ -5,64 +5,72 @@ Creates two file:
 * <output_directory>/output_vocabulary.json.
 """
 import argparse
+from collections import Counter
 import json
 import os
-from tqdm import tqdm
+from file_utils import parse_json, read_lines, with_progress
 
 
 def _to_word_id_dictionary(token_counts, vocabulary_size):
     """
-    Converts a dictionary of form { "word": <count> } to a dictionary
+    Converts a counter of form { "word": <count> } to a dictionary
     of { "word": <word-id> } by trunacting the vocabulary to only
     `vocabulary_size` words with the highest counts.  IDs are assigned
-    from most frequent (1) to least frequent (`vocabulary_size`).
+    from most frequent (0) to least frequent (`vocabulary_size` - 1).
     """
-    count_token_pairs = [(c, t) for (t, c) in token_counts.items()]
-    sorted_count_token_pairs =\
-        sorted(count_token_pairs, key=lambda p: p[0], reverse=True)
+    # Selecting the top words with a heap only beats a full sort when the
+    # vocabulary is much smaller than the number of distinct tokens.
+    if vocabulary_size >= len(token_counts) // 2:
+        count_token_pairs = token_counts.most_common()[:vocabulary_size]
+    else:
+        count_token_pairs = token_counts.most_common(vocabulary_size)
 
     # Construct a mapping from word IDs to their text
-    token_to_id_dictionary = {}
-    vocabulary = [
-        pair[1] for pair in sorted_count_token_pairs[:vocabulary_size]]
-    for (index, token) in enumerate(vocabulary, start=0):
-        token_to_id_dictionary[token] = index
-    return token_to_id_dictionary
+    vocabulary = [token for (token, _) in count_token_pairs]
+    return dict(zip(vocabulary, range(len(vocabulary))))
 
 
-def build_input_vocabulary(
-        training_file_path, input_vocabulary_size,
-        output_directory_path, show_progress):
-    """ Create input vocabulary dictionary and save to a file. """
-
-    # Count up how often each token appears in the inputs
-    token_counts = {}
-    with open(training_file_path) as training_file:
-
-        # Initialize iterator for looping over lines in file
-        line_iterator = training_file
-        if show_progress:
-            line_iterator = tqdm(
-                training_file,
-                desc="Building input vocabulary.  Processing line")
-
-        for line in line_iterator:
-            example = json.loads(line.strip())
-            input_sequences = example['input']
-            for input_sequence in input_sequences:
-                for token in input_sequence:
-                    # Skip the PAD token.  This will always be in the
-                    # vocabulary, regardless of how often it occurs.
-                    if token == "0PAD":
-                        continue
-                    # Also don't count the MID token (which is the placeholder
-                    # for the variable we're trying to predict).  This is not
-                    # actual text and might be removed from the input.
-                    if token == "0MID":
-                        continue
-                    if not token in token_counts:
-                        token_counts[token] = 0
-                    token_counts[token] += 1
+def _count_tokens(training_file_path, show_progress):
+    """
+    Count how often each token appears in the inputs and outputs of the
+    training data, in a single pass over the file.  Returns a pair of
+    counters: (input token counts, output token counts).
+    """
+    input_token_counts = Counter()
+    output_token_counts = Counter()
+
+    # Look up methods once, instead of once for every line
+    update_input_counts = input_token_counts.update
+    get_output_count = output_token_counts.get
+
+    # Initialize iterator for looping over lines in file
+    line_iterator = read_lines(training_file_path)
+    if show_progress:
+        line_iterator = with_progress(
+            line_iterator, "Building vocabularies.  Processing line")
+
+    for line in line_iterator:
+        example = parse_json(line)
+        # Skip the PAD token.  This will always be in the vocabulary,
+        # regardless of how often it occurs.  Also don't count the MID
+        # token (which is the placeholder for the variable we're trying
+        # to predict).  This is not actual text and might be removed
+        # from the input.
+        update_input_counts(
+            token
+            for input_sequence in example['input']
+            for token in input_sequence
+            if token not in ("0PAD", "0MID"))
+        output_token = example['output']
+        output_token_counts[output_token] =\
+            get_output_count(output_token, 0) + 1
+
+    return input_token_counts, output_token_counts
+
+
+def _save_input_vocabulary(
+        token_counts, input_vocabulary_size, output_directory_path):
+    """ Create input vocabulary dictionary from counts and save to a file. """
 
     token_to_id_dictionary = _to_word_id_dictionary(
         token_counts, input_vocabulary_size)
@@ -77,28 +85,9 @@ def build_input_vocabulary(
         json.dump(token_to_id_dictionary, output_file, indent=2)
 
 
-def build_output_vocabulary(
-        training_file_path, output_vocabulary_size,
-        output_directory_path, show_progress):
-    """ Create output vocabulary dictionary and save to a file. """
-
-    # Count up how often each token appears in the example output
-    token_counts = {}
-    with open(training_file_path) as training_file:
-
-        # Initialize iterator for looping over lines in file
-        line_iterator = training_file
-        if show_progress:
-            line_iterator = tqdm(
-                training_file,
-                desc="Building output vocabulary.  Processing line")
-
-        for line in line_iterator:
-            example = json.loads(line.strip())
-            token = example['output']
-            if not token in token_counts:
-                token_counts[token] = 0
-            token_counts[token] += 1
+def _save_output_vocabulary(
+        token_counts, output_vocabulary_size, output_directory_path):
+    """ Create output vocabulary dictionary from counts and save to a file. """
 
     token_to_id_dictionary = _to_word_id_dictionary(
         token_counts, output_vocabulary_size)
@@ -112,6 +101,36 @@ def build_output_vocabulary(
         json.dump(token_to_id_dictionary, output_file, indent=2)
 
 
+def build_vocabularies(
+        training_file_path, input_vocabulary_size, output_vocabulary_size,
+        output_directory_path, show_progress):
+    """ Create input and output vocabulary dictionaries and save to files. """
+    input_token_counts, output_token_counts = _count_tokens(
+        training_file_path, show_progress)
+    _save_input_vocabulary(
+        input_token_counts, input_vocabulary_size, output_directory_path)
+    _save_output_vocabulary(
+        output_token_counts, output_vocabulary_size, output_directory_path)
+
+
+def build_input_vocabulary(
+        training_file_path, input_vocabulary_size,
+        output_directory_path, show_progress):
+    """ Create input vocabulary dictionary and save to a file. """
+    token_counts, _ = _count_tokens(training_file_path, show_progress)
+    _save_input_vocabulary(
+        token_counts, input_vocabulary_size, output_directory_path)
+
+
+def build_output_vocabulary(
+        training_file_path, output_vocabulary_size,
+        output_directory_path, show_progress):
+    """ Create output vocabulary dictionary and save to a file. """
+    _, token_counts = _count_tokens(training_file_path, show_progress)
+    _save_output_vocabulary(
+        token_counts, output_vocabulary_size, output_directory_path)
+
+
 if __name__ == '__main__':
 
     # Process program arguments
@@ -156,10 +175,7 @@ if __name__ == '__main__':
     if not os.path.exists(OUTPUT_DIRECTORY_PATH):
         os.mkdir(OUTPUT_DIRECTORY_PATH)
 
-    build_input_vocabulary(
+    build_vocabularies(
         ARGS.training_file, ARGS.input_vocabulary_size,
-        OUTPUT_DIRECTORY_PATH, ARGS.show_progress)
-
-    build_output_vocabulary(
-        ARGS.training_file, ARGS.output_vocabulary_size,
-        OUTPUT_DIRECTORY_PATH, ARGS.show_progress)
+        ARGS.output_vocabulary_size, OUTPUT_DIRECTORY_PATH,
+        ARGS.show_progress)
@@ -0,0 +1,69 @@
+"""
+Helpers for reading the large, line-oriented data files used by the
+pre-processing scripts, and for reporting progress through them.
+"""
+
+import sys
+
+# Callers parse one line at a time and drop each example before parsing the
+# next, so its lists and strings are freed right away by reference counting.
+# A parser that reuses one buffer across documents (like simdjson's) doesn't
+# save anything here, as every token in an example is read anyway.
+try:
+    from orjson import loads as parse_json
+except ImportError:
+    # The standard library parser is several times slower, but accepts
+    # the same bytes lines.
+    from json import loads as parse_json
+
+# Read files 4 MiB at a time.
+CHUNK_SIZE = 1 << 22
+
+# Report progress once every this many items.
+PROGRESS_INTERVAL = 100000
+
+
+def read_lines(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the lines in a file as bytes, without their trailing
+    newlines.  The file is read in large binary chunks, which is much
+    faster than iterating over a text file one line at a time.
+    """
+    with open(file_path, 'rb') as file_:
+        remainder = b''
+        while True:
+            chunk = file_.read(chunk_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            # The last piece is an incomplete line, or empty if the chunk
+            # ended on a newline.  Save it to prepend to the next chunk.
+            remainder = lines.pop()
+            yield from lines
+        if remainder:
+            yield remainder
+
+
+def with_progress(iterable, desc, interval=PROGRESS_INTERVAL, get_size=None):
+    """
+    Iterate over `iterable`, printing how many items have been handled once
+    every `interval` items, and once more at the end if that count hasn't
+    been printed yet.  An item is counted after the caller is done with it.
+    If `get_size` is given, each item counts as `get_size(item)` items
+    (for instance, the number of rows in a chunk).  Unlike tqdm, this
+    doesn't check the time or redraw anything for each item, which adds
+    up in loops that do little work per line.
+    """
+    count = 0
+    reported_count = 0
+    for item in iterable:
+        yield item
+        count += 1 if get_size is None else get_size(item)
+        if count - reported_count >= interval:
+            print("\r{}: {}".format(desc, count), end='', file=sys.stderr)
+            reported_count = count
+    if count == reported_count and count > 0:
+        # The final count is already shown, so just end its line.
+        print(file=sys.stderr)
+    else:
+        print("\r{}: {}".format(desc, count), file=sys.stderr)
@@ -1,74 +1,201 @@
 """
 Transforms input data to use word IDs instead of text, and outputs the
-transformed data to <output_directory>/<input_basename>.csv.
-Output is a CSV, where the first column is the label (output token ID),
-and all other columns are the IDs of the input tokens.
+transformed data to <output_directory>/<input_basename>.npy.
+Output is a 2-D array in NumPy's .npy format, with one row per example.
+The first column is the label (output token ID), and all other columns
+are the IDs of the input tokens.  Every row has the same width, so the
+file can be memory-mapped and read without any parsing.  IDs are stored
+as 16-bit unsigned integers when both vocabularies fit in that range,
+halving the size of the data, and as 32-bit integers otherwise.
 Deletes the "0MID" token from each input sequence, as we don't
 expect it will carry any useful information.
 """
 
 import argparse
+import collections
+import itertools
 import json
+import multiprocessing
 import os
-from tqdm import tqdm
+import numpy as np
+from file_utils import parse_json, read_lines, with_progress
+
+
+def _sequence_to_ids(sequence, get_token_id, unknown_id, context_size):
+    """
+    Convert a sequence of tokens to a list of their IDs.  Takes the bound
+    `get` method of the token-to-ID map, and uses `unknown_id` for tokens
+    that aren't in the vocabulary.
+    """
+    # Leave out the middle token (the placeholder whose name will be
+    # predicted), as it does not carry information.  Converting each side
+    # separately avoids deleting from the middle of the list afterwards.
+    # This code makes an assumption that the "0MID" token will always
+    # appear at the middle of the sequence.
+    left_ids = [
+        get_token_id(token, unknown_id) for token in sequence[:context_size]]
+    right_ids = [
+        get_token_id(token, unknown_id)
+        for token in sequence[context_size + 1:]]
+    return left_ids + right_ids
+
+
+# Number of lines sent to a worker process at a time.
+LINES_PER_CHUNK = 10000
+
+# Size of the buffer for writing the output file.
+WRITE_BUFFER_SIZE = 1 << 20
+
+# State for converting lines in a worker process.  Set once per process by
+# `_initialize_worker`, so the vocabularies aren't sent with every chunk.
+_WORKER_STATE = None
+
+
+def _get_id_dtype(*token_to_id_maps):
+    """ Get the smallest type that can hold every ID in the given maps. """
+    max_id = max(max(id_map.values()) for id_map in token_to_id_maps)
+    if max_id <= np.iinfo(np.uint16).max:
+        return np.uint16
+    return np.int32
+
+
+def _initialize_worker(
+        input_token_to_id_map, output_token_to_id_map, context_size,
+        sequences_per_example, id_dtype):
+    """ Set up the state a worker process needs to convert lines. """
+    global _WORKER_STATE  # pylint: disable=global-statement
+
+    # IDs for a sequence that is nothing but 0PAD tokens, used for examples
+    # that have fewer than the expected number of sequences.  The "0MID"
+    # token is left out, as it is for all other sequences.
+    padding_ids = [input_token_to_id_map["0PAD"]] * (context_size * 2)
+
+    # Look up the map methods and unknown token IDs once, instead of
+    # once for every line or token.  The input vocabulary only has a few
+    # thousand tokens, so one lookup in it costs as much as a lookup in a
+    # cache of the most frequent tokens would; a cache only adds a second
+    # lookup for the tokens it misses.
+    _WORKER_STATE = (
+        input_token_to_id_map.get, output_token_to_id_map.get,
+        input_token_to_id_map["UNK"], output_token_to_id_map["UNK"],
+        padding_ids, context_size, sequences_per_example, id_dtype,
+    )
+
+
+def _process_lines(lines):
+    """
+    Replace text with dictionary indexes for a chunk of lines from the
+    data file.  Returns the raw bytes of the chunk's rows of token IDs.
+    """
+    (get_input_id, get_output_id, unknown_input_id, unknown_output_id,
+     padding_ids, context_size, sequences_per_example, id_dtype) =\
+        _WORKER_STATE
+
+    rows = []
+    add_row = rows.append
+    for line in lines:
+        example = parse_json(line)
+        row = []  # these are the columns we will output to file
+
+        # Replace output token with ID
+        row.append(get_output_id(example['output'], unknown_output_id))
+
+        # Replace all input tokens with IDs, and add the sequences to
+        # this row of the output data
+        input_sequences = example['input'][:sequences_per_example]
+        for sequence in input_sequences:
+            row.extend(_sequence_to_ids(
+                sequence, get_input_id, unknown_input_id, context_size))
+
+        # If there are fewer sequences than expected in the training
+        # data, fill the rest of the row with padding sequences.
+        row.extend(
+            padding_ids * (sequences_per_example - len(input_sequences)))
+
+        add_row(row)
+    return np.array(rows, dtype=id_dtype).tobytes()
 
 
 def process_data_file(
         data_file_path, input_token_to_id_map, output_token_to_id_map,
-        context_size, sequences_per_example, output_path, show_progress):
-    """ Replace text in training data with dictionary indexes. """
-
-    with open(data_file_path) as data_file,\
-         open(output_path, 'w') as output_file:
-
-        # Initialize iterator for looping over lines in file
-        line_iterator = data_file
-        if show_progress:
-            line_iterator = tqdm(
-                data_file,
-                desc="Processing data file, current line")
-
-        for line in line_iterator:
-            example = json.loads(line.strip())
-            csv_data = []  # these are the columns we will output to file
-
-            # Replace output token with ID
-            output_token = example['output']
-            if output_token not in output_token_to_id_map:
-                output_token = "UNK"
-            output_token_id = output_token_to_id_map[output_token]
-            csv_data.append(output_token_id)
-
-            # Replace all input tokens with IDs
-            input_sequences = example['input']
-            for sequence_index in range(sequences_per_example):
-
-                # If this sequence isn't in the training data, generate on
-                # that is nothing but 0PAD tokens.
-                if sequence_index >= len(input_sequences):
-                    input_sequences.append(
-                        (["0PAD"] * context_size) + ["0MID"] +\
-                        (["0PAD"] * context_size))
-                sequence = input_sequences[sequence_index]
-
-                # Replace tokens with IDs
-                for token_index, token in enumerate(sequence):
-                    if token not in input_token_to_id_map:
-                        token = "UNK"
-                    token_id = input_token_to_id_map[token]
-                    sequence[token_index] = token_id
-
-                # Delete the middle token from the list (the placeholder whose
-                # name will be predicted), as it does not carry information.
-                # This code makes an assumption that the "0MID" token will always
-                # appear at the middle of the sequence.
-                del sequence[context_size]
-
-                # Add the sequence to this row of the output data
-                csv_data.extend(sequence)
-
-            # Write to the output file (one line at a time)
-            output_file.write(",".join([str(i) for i in csv_data]) + "\n")
+        context_size, sequences_per_example, output_path, show_progress,
+        processes=None):
+    """
+    Replace text in training data with dictionary indexes.  Chunks of lines
+    are converted in parallel by `processes` worker processes (by default,
+    one per CPU).
+    """
+
+    # The .npy header holds the shape of the array, so count the examples
+    # before writing any of them.  The `+1` column is for the label.
+    example_count = sum(1 for _ in read_lines(data_file_path))
+    column_count = (context_size * 2) * sequences_per_example + 1
+    id_dtype = _get_id_dtype(input_token_to_id_map, output_token_to_id_map)
+
+    # Initialize iterator for looping over lines in file
+    line_iterator = read_lines(data_file_path)
+
+    # Only let a few chunks per process be read ahead of the chunks that
+    # have been written, so the whole file isn't read into memory.  Chunks
+    # are submitted from this thread, so nothing is left blocked waiting
+    # for room if a worker fails.
+    worker_count = processes or os.cpu_count()
+    max_pending_chunks = worker_count * 4
+
+    # Write to a temporary file, and only move it to `output_path` once
+    # every row is written.  Otherwise a failure would leave behind a file
+    # whose header promises rows that aren't there.
+    partial_output_path = output_path + ".partial"
+
+    worker_args = (
+        input_token_to_id_map, output_token_to_id_map, context_size,
+        sequences_per_example, id_dtype)
+    try:
+        with multiprocessing.Pool(
+                worker_count, _initialize_worker, worker_args) as pool,\
+             open(partial_output_path, 'wb',
+                  buffering=WRITE_BUFFER_SIZE) as output_file:
+
+            np.lib.format.write_array_header_1_0(output_file, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(id_dtype)),
+                'fortran_order': False,
+                'shape': (example_count, column_count),
+            })
+
+            def _processed_chunks():
+                """ Yield (row count, pending result) for each chunk. """
+                chunks = iter(
+                    lambda: list(
+                        itertools.islice(line_iterator, LINES_PER_CHUNK)),
+                    [])
+                pending_chunks = collections.deque()
+                for chunk in chunks:
+                    result = pool.apply_async(_process_lines, (chunk,))
+                    pending_chunks.append((len(chunk), result))
+                    if len(pending_chunks) >= max_pending_chunks:
+                        yield pending_chunks.popleft()
+                while pending_chunks:
+                    yield pending_chunks.popleft()
+
+            # Progress is counted as chunks are written, not as they're
+            # read, as reading runs ahead of the workers.
+            processed_chunks = _processed_chunks()
+            if show_progress:
+                processed_chunks = with_progress(
+                    processed_chunks, "Processing data file, rows written",
+                    get_size=lambda processed_chunk: processed_chunk[0])
+
+            # Chunks are written in the order they were read, so rows in the
+            # output file line up with examples in the data file.  Each chunk
+            # arrives as one block of bytes, so it takes a single write.  If
+            # a worker raised an error, `get` raises it here.
+            for _, rows in processed_chunks:
+                output_file.write(rows.get())
+    except BaseException:
+        if os.path.exists(partial_output_path):
+            os.remove(partial_output_path)
+        raise
+    os.replace(partial_output_path, output_path)
 
 
 if __name__ == '__main__':
@@ -126,6 +253,14 @@ if __name__ == '__main__':
         action='store_true',
         help="Whether to show progress building the vocabulary.",
         )
+    PARSER.add_argument(
+        '-j',
+        '--processes',
+        type=int,
+        help=(
+            "Number of worker processes to convert lines with.  Defaults " +
+            "to the number of CPUs."),
+        )
     ARGS = PARSER.parse_args()
 
     OUTPUT_DIRECTORY_PATH = ARGS.output_directory
@@ -141,9 +276,9 @@ if __name__ == '__main__':
     # Make the name for an output file from the input file name.
     OUTPUT_PATH = os.path.join(
         OUTPUT_DIRECTORY_PATH,
-        os.path.splitext(os.path.basename(ARGS.data_file))[0] + ".csv"
+        os.path.splitext(os.path.basename(ARGS.data_file))[0] + ".npy"
     )
     process_data_file(
         ARGS.data_file, INPUT_TOKEN_TO_ID_MAP, OUTPUT_TOKEN_TO_ID_MAP,
         ARGS.context_size, ARGS.sequences_per_example, OUTPUT_PATH,
-        ARGS.show_progress)
+        ARGS.show_progress, ARGS.processes)
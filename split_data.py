@@ -1,62 +1,67 @@
 """
-Splits a training file into a training and validation file.  Assumes there
-is a separate example on each line.
-* <output_directory>/training.<ext>
-* <output_directory>/validation.<ext>
+Splits a processed data file (a .npy array with one example per row) into
+a training and validation file.  Examples are shuffled as they're split,
+so the output files can be used for training directly.
+* <output_directory>/training.npy
+* <output_directory>/validation.npy
 """
 
 import argparse
 import math
 import os
 import numpy as np
-from tqdm import tqdm
+from file_utils import with_progress
+
+
+# Number of rows copied into an output file at a time.
+ROWS_PER_CHUNK = 100000
+
+
+def _write_rows(data, row_indexes, output_path, show_progress, desc):
+    """
+    Write the rows of `data` at `row_indexes`, in that order, to a new .npy
+    file at `output_path`.
+    """
+    output = np.lib.format.open_memmap(
+        output_path, mode='w+', dtype=data.dtype,
+        shape=(len(row_indexes),) + data.shape[1:])
+
+    chunk_starts = range(0, len(row_indexes), ROWS_PER_CHUNK)
+    if show_progress:
+        chunk_starts = with_progress(chunk_starts, desc, interval=1)
+
+    for start in chunk_starts:
+        end = start + ROWS_PER_CHUNK
+        output[start:end] = data[row_indexes[start:end]]
+    output.flush()
 
 
 def split_data_file(
-        data_file_path, output_directory_path, validation_ratio, show_progress):
+        data_file_path, output_directory_path, validation_ratio, show_progress,
+        seed=None):
     """ Split a data file into a training and validation file. """
 
-    # Count the number of data points
-    example_count = 0
-    with open(data_file_path) as data_file:
-        for line in data_file:
-            example_count += 1
+    # Memory-map the data, rather than reading it all into memory.
+    data = np.load(data_file_path, mmap_mode='r')
+    example_count = len(data)
 
     # Compute how many examples should be included in the validation set
     validation_count = math.floor(example_count * validation_ratio)
 
-    # Determine beforehand whether each example should go into the
-    # training or validation set.  We do this by making evenly-spaced values
-    # from 0 to 1 for each example.  If the value for that index is less
-    # than the validation ratio, it belongs in the validation set.
-    example_indexes = np.arange(0, example_count) / example_count
-    np.random.shuffle(example_indexes)
-    is_validation_index = example_indexes < validation_ratio
+    # Shuffle the example indexes.  The first `validation_count` of them
+    # are the validation set, and the rest are the training set.
+    example_indexes = np.random.RandomState(seed).permutation(example_count)
 
     # Initialize paths to training and validation files
-    file_ext = os.path.splitext(data_file_path)[1]
-    validation_path = os.path.join(
-        output_directory_path, 'validation' + file_ext)
-    training_path = os.path.join(
-        output_directory_path, 'training' + file_ext)
-
-    # Split the data file into training and validation files
-    with open(data_file_path) as data_file,\
-         open(validation_path, 'w') as validation_file,\
-         open(training_path, 'w') as training_file:
-
-        # Initialize iterator for looping over lines in file
-        line_iterator = data_file
-        if show_progress:
-            line_iterator = tqdm(
-                data_file,
-                desc="Splitting data file, current line")
-
-        for example_index, line in enumerate(line_iterator):
-            if is_validation_index[example_index]:
-                validation_file.write(line)
-            else:
-                training_file.write(line)
+    validation_path = os.path.join(output_directory_path, 'validation.npy')
+    training_path = os.path.join(output_directory_path, 'training.npy')
+
+    _write_rows(
+        data, example_indexes[:validation_count], validation_path,
+        show_progress, "Writing validation data, current chunk")
+    _write_rows(
+        data, example_indexes[validation_count:], training_path,
+        show_progress, "Writing training data, current chunk")
 
 
 if __name__ == '__main__':
@@ -66,7 +71,9 @@ if __name__ == '__main__':
         description="Split data file into a training and validation file.")
     PARSER.add_argument(
         'data_file',
-        help="Path to file containing data to split.  One example per line.",
+        help=(
+            "Path to .npy file containing data to split.  One example " +
+            "per row."),
         )
     PARSER.add_argument(
         '-d',
@@ -88,6 +95,12 @@ if __name__ == '__main__':
         action='store_true',
         help="Whether to show progress building the vocabulary.",
         )
+    PARSER.add_argument(
+        '-s',
+        '--seed',
+        type=int,
+        help="Seed for randomly shuffling and splitting the examples.",
+        )
     ARGS = PARSER.parse_args()
 
     OUTPUT_DIRECTORY_PATH = ARGS.output_directory
@@ -96,4 +109,4 @@ if __name__ == '__main__':
 
     split_data_file(
         ARGS.data_file, OUTPUT_DIRECTORY_PATH, ARGS.validation_ratio,
-        ARGS.show_progress)
+        ARGS.show_progress, ARGS.seed)
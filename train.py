@@ -3,46 +3,95 @@ Train a model to predict variable names from their context.
 """
 
 import argparse
+import math
 import os
+import numpy as np
 import tensorflow as tf
 
 
-def _get_feature_names(sequences_per_example, context_size):
-    """ Compute feature names given expected input dimensions. """
-    feature_names = []
-    for sequence_index in range(sequences_per_example):
-        for direction in ["left", "right"]:
-            for context_index in range(context_size):
-                feature_names.append(
-                    "seq{sequence_index}_{direction}{context_index}".format(
-                        sequence_index=sequence_index,
-                        direction=direction,
-                        context_index=context_index,
-                    ))
-    return feature_names
-
-
-def input_fn(data_file_path, batch_size, feature_names, column_count):
-
-    def _parse_line(line):
-        decoded = tf.decode_csv(line, record_defaults=[[-1]] * column_count)
-        label = decoded[0]
-        features = decoded[1:]
-        return dict(zip(feature_names, features)), label
-
-    # Set up data input as a CSV file reader.
-    # Don't shuffle here, as there are enough lines that I don't want to shuffle
-    # them all in memory.  Assume examples have already been shuffled.
+def input_fn(data_file_path, batch_size, column_count):
+
+    # The data is a .npy array with one fixed-length row per example, so
+    # each example can be read as a raw record, without any text parsing.
+    # Memory-map the file to read its header without loading the data.
+    data = np.load(data_file_path, mmap_mode='r')
+    if data.shape[1] != column_count:
+        raise ValueError(
+            "Expected {} columns in {}, found {}.".format(
+                column_count, data_file_path, data.shape[1]))
+    record_bytes = column_count * data.dtype.itemsize
+    record_dtype = tf.as_dtype(data.dtype)
+
+    def _parse_records(records):
+        # IDs may be stored in a smaller type than the model uses for them.
+        decoded = tf.cast(tf.decode_raw(records, record_dtype), tf.int32)
+        labels = decoded[:, 0]
+        features = decoded[:, 1:]
+        return features, labels
+
+    # Don't shuffle here, as there are enough examples that I don't want to
+    # shuffle them all in memory.  Assume examples have already been
+    # shuffled.  Records are batched before decoding so that a whole batch
+    # is decoded by one op.  Batches are decoded on all cores, and the next
+    # batch is prepared while the model trains on the current one.
     dataset = (
-        tf.data.TextLineDataset([data_file_path])
-        .map(_parse_line) 
+        tf.data.FixedLengthRecordDataset(
+            [data_file_path], record_bytes, header_bytes=data.offset)
         .batch(batch_size)
+        .map(_parse_records, num_parallel_calls=os.cpu_count())
+        .prefetch(1)
         )
     iterator = dataset.make_one_shot_iterator()
     features, labels = iterator.get_next()
     return features, labels
 
 
+def _model_fn(features, labels, mode, params):
+    """
+    Predict an output token from a dense tensor of input token IDs.  All
+    input tokens share one embedding matrix.  Their embeddings are
+    concatenated and passed through fully-connected hidden layers.
+    """
+    embedding_dimensions = params['embedding_dimensions']
+    embeddings = tf.get_variable(
+        "embeddings",
+        shape=[params['input_vocabulary_size'], embedding_dimensions],
+        initializer=tf.truncated_normal_initializer(
+            stddev=1 / math.sqrt(embedding_dimensions)),
+        )
+    net = tf.layers.flatten(tf.nn.embedding_lookup(embeddings, features))
+    for units in params['hidden_units']:
+        net = tf.layers.dense(net, units, activation=tf.nn.relu)
+    logits = tf.layers.dense(net, params['output_vocabulary_size'])
+    class_ids = tf.argmax(logits, axis=1)
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+        predictions = {
+            'class_ids': class_ids,
+            'probabilities': tf.nn.softmax(logits),
+            'logits': logits,
+        }
+        return tf.estimator.EstimatorSpec(mode, predictions=predictions)
+
+    # Sum the loss over the batch, as DNNClassifier does by default, so the
+    # gradients have the same scale for its default learning rate.
+    loss = tf.losses.sparse_softmax_cross_entropy(
+        labels=labels, logits=logits, reduction=tf.losses.Reduction.SUM)
+    if mode == tf.estimator.ModeKeys.EVAL:
+        metrics = {
+            'accuracy': tf.metrics.accuracy(
+                labels=labels, predictions=class_ids),
+        }
+        return tf.estimator.EstimatorSpec(
+            mode, loss=loss, eval_metric_ops=metrics)
+
+    # Use the same optimizer that DNNClassifier uses by default
+    optimizer = tf.train.AdagradOptimizer(learning_rate=0.05)
+    train_op = optimizer.minimize(
+        loss, global_step=tf.train.get_global_step())
+    return tf.estimator.EstimatorSpec(mode, loss=loss, train_op=train_op)
+
+
 def train(
         training_file_path, validation_file_path, sequences_per_example,
         context_size, input_vocabulary_size, output_vocabulary_size,
@@ -50,28 +99,22 @@ def train(
         model_directory_path):
     """ Train the model. """
 
-    # Dynamically compute the feature names from the expected input properties.
-    feature_names = _get_feature_names(sequences_per_example, context_size)
-
     # Compute the number of expected columns in the data from input properties.
     # The `+1` is there for the first, label column.
     column_count = (context_size * 2) * sequences_per_example + 1
 
-    # Create a column for each context token.  Then mark them as sharing
-    # a set of embedding parameters.  These are the features.
-    columns = []
-    for feature_name in feature_names:
-        columns.append(tf.feature_column.categorical_column_with_identity(
-            feature_name, num_buckets=input_vocabulary_size))
-    embeddings = tf.feature_column.shared_embedding_columns(
-        columns, embedding_dimensions)
-
-    # Use an off-the-shelf classifier
-    estimator = tf.estimator.DNNClassifier(
-        feature_columns=embeddings,
-        n_classes=output_vocabulary_size,
-        hidden_units=hidden_units,
+    # Embed the context tokens and classify them with a dense network.  The
+    # input is a single tensor of token IDs rather than one feature column
+    # per context token.
+    estimator = tf.estimator.Estimator(
+        model_fn=_model_fn,
         model_dir=model_directory_path,
+        params={
+            'input_vocabulary_size': input_vocabulary_size,
+            'output_vocabulary_size': output_vocabulary_size,
+            'embedding_dimensions': embedding_dimensions,
+            'hidden_units': hidden_units,
+        },
     )
 
     # with tf.Session():
@@ -81,7 +124,7 @@ def train(
 
             # Reset the training and validation data generators
             training_input_fn = lambda: input_fn(
-                training_file_path, batch_size, feature_names, column_count)
+                training_file_path, batch_size, column_count)
 
             # Train the model
             try:
@@ -101,15 +144,15 @@ if __name__ == '__main__':
         '-t',
         '--training-file',
         type=str,
-        help="Path to file containing training data (CSV).",
-        default=os.path.join("processed", "training_shuffled.csv"),
+        help="Path to file containing training data (.npy).",
+        default=os.path.join("processed", "training.npy"),
         )
     PARSER.add_argument(
         '-v',
         '--validation-file',
         type=str,
-        help="Path to file containing validation data (CSV).",
-        default=os.path.join("processed", "validation.csv"),
+        help="Path to file containing validation data (.npy).",
+        default=os.path.join("processed", "validation.npy"),
         )
     PARSER.add_argument(
         '-m',